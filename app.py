@@ -1,9 +1,20 @@
 import streamlit as st
-from PIL import Image
+from PIL import Image, ImageOps
 import base64
-from io import BytesIO
+from io import BytesIO, StringIO
 import requests
 import time
+import functools
+import hashlib
+import json
+import os
+import csv
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+# Measure how long each full script run takes (CSS, header and state init included)
+SCRIPT_STARTED = time.perf_counter()
 
 # ---------------- PAGE CONFIG ----------------
 st.set_page_config(
@@ -15,6 +26,26 @@ st.set_page_config(
 # ---------------- CONFIGURATION ----------------
 TRACKER_URL = "https://image-caption-studio-url-tracker.onrender.com"  # ← YOUR TRACKER URL HERE
 
+# Upload limits - keep worst-case decode memory/CPU bounded (override via environment)
+# The byte limit defaults to server.maxUploadSize (.streamlit/config.toml), which makes
+# Streamlit refuse larger files before buffering them. MAX_UPLOAD_MB can only TIGHTEN
+# that limit - raise server.maxUploadSize itself to accept bigger files
+SERVER_MAX_UPLOAD_MB = st.get_option("server.maxUploadSize")
+MAX_UPLOAD_MB = min(int(os.environ.get("MAX_UPLOAD_MB", SERVER_MAX_UPLOAD_MB)), SERVER_MAX_UPLOAD_MB)
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 50_000_000))   # Checked from the header
+MAX_IMAGE_SIDE = int(os.environ.get("MAX_IMAGE_SIDE", 2048))             # Downsample before preview/API
+PREVIEW_SIZE = (600, 450)             # Image box dimensions
+
+# Caption history - every generated caption is kept here and reused when possible
+HISTORY_DB_PATH = os.environ.get("CAPTION_HISTORY_DB", "caption_history.db")
+HISTORY_PAGE_SIZE = 10
+# The CSV download is built in memory, so it is capped (newest rows first)
+HISTORY_EXPORT_MAX_ROWS = int(os.environ.get("HISTORY_EXPORT_MAX_ROWS", 50_000))
+
+# Pillow's own decompression-bomb guard uses the same limit
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
 # ---------------- CSS (EXACT ORIGINAL - UNCHANGED) ----------------
 st.markdown("""
 <style>
@@ -218,9 +249,71 @@ if 'initialized' not in st.session_state:
     st.session_state.backend_url = None
     st.session_state.backend_status = "checking"
     st.session_state.backend_info = {}
+    st.session_state.rerun_timings = {}
+    st.session_state.image_hash = None
+    st.session_state.history_cursors = [None]
+    st.session_state.history_search = ""
+    st.session_state.regenerate_requested = False
+    st.session_state.history_save_error = None
+    st.session_state.history_reused = False
     st.session_state.initialized = True
 
 # ---------------- HELPER FUNCTIONS ----------------
+def timed(name: str):
+    """Record how long a section took (in ms) under rerun_timings[name]"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                st.session_state.rerun_timings[name] = round(elapsed_ms, 1)
+        return wrapper
+    return decorator
+
+def load_upload_image(uploaded_file) -> Image.Image:
+    """Decode an upload within the size limits, downsampled to MAX_IMAGE_SIDE"""
+    if uploaded_file.size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"File is too large ({uploaded_file.size / 1024 / 1024:.1f} MB, "
+                         f"limit is {MAX_UPLOAD_MB} MB)")
+    
+    # Image.open only reads the header, so the size is known before decoding
+    image = Image.open(uploaded_file)
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image is too large ({width}x{height}, "
+                         f"limit is {MAX_IMAGE_PIXELS // 1_000_000} MP)")
+    
+    # JPEG draft mode: let the decoder scale by 1/2, 1/4 or 1/8 while decoding,
+    # as far as it can without going below the final size (no-op for PNG)
+    scale = min(1.0, MAX_IMAGE_SIDE / max(width, height))
+    image.draft(image.mode, (max(1, int(width * scale)), max(1, int(height * scale))))
+    
+    # reduce() + resample down to MAX_IMAGE_SIDE
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    
+    # Rotate AFTER downsampling - much cheaper on the small image
+    image = ImageOps.exif_transpose(image)
+    
+    # 16-bit grayscale: scale down to 8-bit (a plain convert would clip it to white)
+    if image.mode in ("I", "I;16", "I;16B", "I;16L"):
+        image = image.convert("I").point(lambda v: v / 256).convert("L")
+    
+    # CMYK / palette / LA images become RGB(A) for the preview and the API
+    if image.mode not in ("RGB", "RGBA", "L"):
+        has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    
+    return image
+
+def clear_captions():
+    """Generate New Captions callback - the next Generate goes to the backend"""
+    st.session_state.captions_generated = False
+    st.session_state.generated_captions = {}
+    st.session_state.regenerate_requested = True
+
 def get_backend_from_tracker():
     """Ask tracker service for current Colab URL"""
     try:
@@ -255,12 +348,12 @@ def test_backend_connection(url):
         return False
 
 def generate_captions_from_api(image: Image.Image, styles: list, word_limits: dict) -> dict:
-    """Call API with ORIGINAL PIL Image"""
+    """Call API with the uploaded PIL Image"""
     if not st.session_state.backend_url:
         return {'success': False, 'error': 'No backend URL found'}
     
     try:
-        # Convert ORIGINAL image to base64
+        # Convert uploaded image to base64
         buffered = BytesIO()
         image.save(buffered, format="PNG")
         img_str = base64.b64encode(buffered.getvalue()).decode()
@@ -289,8 +382,126 @@ def generate_captions_from_api(image: Image.Image, styles: list, word_limits: di
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-# ---------------- SIDEBAR: AUTO-FIND BACKEND (NEW) ----------------
-with st.sidebar:
+# ---------------- CAPTION HISTORY (SQLITE + FTS5) ----------------
+@st.cache_resource
+def init_history_db() -> str:
+    """Create the history database once per process and return its path"""
+    with closing(sqlite3.connect(HISTORY_DB_PATH)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS captions (
+                id INTEGER PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                caption_type TEXT NOT NULL,
+                word_limit INTEGER,
+                caption TEXT NOT NULL,
+                params TEXT NOT NULL,
+                model TEXT,
+                duration_ms REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_captions_lookup
+                ON captions (image_hash, caption_type, word_limit, model);
+            CREATE VIRTUAL TABLE IF NOT EXISTS captions_fts
+                USING fts5(caption, content='captions', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS captions_fts_insert AFTER INSERT ON captions BEGIN
+                INSERT INTO captions_fts (rowid, caption) VALUES (new.id, new.caption);
+            END;
+            CREATE TRIGGER IF NOT EXISTS captions_fts_delete AFTER DELETE ON captions BEGIN
+                INSERT INTO captions_fts (captions_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+            END;
+        """)
+    return HISTORY_DB_PATH
+
+def connect_history_db() -> sqlite3.Connection:
+    """Open a connection to the history database (one per call, safe across sessions)"""
+    conn = sqlite3.connect(init_history_db(), timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def fts_query(search: str) -> str:
+    """Quote each search word so user input can't break the FTS5 query syntax"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in search.split())
+
+def save_captions_to_history(image_hash: str, captions: dict, styles: list,
+                             word_limits: dict, model: str, duration_ms: float):
+    """Record every caption from one API call"""
+    created_at = datetime.now().isoformat(timespec="seconds")
+    params = json.dumps({"styles": styles, "word_limits": word_limits, "max_image_side": MAX_IMAGE_SIDE})
+    rows = [
+        (created_at, image_hash, caption_type, word_limits.get(caption_type),
+         caption_data.get('caption', ''), params, model, duration_ms)
+        for caption_type, caption_data in captions.items()
+    ]
+    with closing(connect_history_db()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO captions (created_at, image_hash, caption_type, word_limit, "
+            "caption, params, model, duration_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+def find_captions_in_history(image_hash: str, caption_types: list, word_limits: dict, model: str) -> dict:
+    """Return the latest stored caption for each type, or {} unless ALL types are found"""
+    captions = {}
+    with closing(connect_history_db()) as conn:
+        for caption_type in caption_types:
+            # Same MAX_IMAGE_SIDE too, otherwise the backend saw a different image
+            row = conn.execute(
+                "SELECT caption FROM captions WHERE image_hash = ? AND caption_type = ? "
+                "AND word_limit = ? AND model IS ? "
+                "AND json_extract(params, '$.max_image_side') = ? ORDER BY id DESC LIMIT 1",
+                (image_hash, caption_type, word_limits.get(caption_type), model, MAX_IMAGE_SIDE)
+            ).fetchone()
+            if row is None:
+                return {}
+            captions[caption_type] = {'caption': row['caption']}
+    return captions
+
+def build_history_query(search: str = "", before_id: int = None) -> tuple:
+    """SQL + args for history rows, newest first (optionally full-text filtered)"""
+    conditions, args = [], []
+    if search.strip():
+        # Let FTS5 drive the query so it walks its own rowids newest-first
+        sql = "SELECT c.* FROM captions_fts f JOIN captions c ON c.id = f.rowid"
+        id_column = "f.rowid"
+        conditions.append("captions_fts MATCH ?")
+        args.append(fts_query(search))
+    else:
+        sql = "SELECT c.* FROM captions c"
+        id_column = "c.id"
+    if before_id is not None:
+        conditions.append(f"{id_column} < ?")
+        args.append(before_id)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {id_column} DESC"
+    return sql, args
+
+def query_history(search: str = "", before_id: int = None) -> list:
+    """One page of history - keyset pagination on id stays fast at any depth"""
+    sql, args = build_history_query(search, before_id)
+    with closing(connect_history_db()) as conn:
+        return conn.execute(sql + " LIMIT ?", args + [HISTORY_PAGE_SIZE]).fetchall()
+
+def export_history_csv(search: str = "") -> bytes:
+    """CSV of the newest HISTORY_EXPORT_MAX_ROWS matching rows (built only on click)"""
+    columns = ["id", "created_at", "image_hash", "caption_type", "word_limit",
+               "caption", "params", "model", "duration_ms"]
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    sql, args = build_history_query(search)
+    with closing(connect_history_db()) as conn:
+        # Streamlit needs the whole file in memory, so the row cap bounds its size
+        for row in conn.execute(sql + " LIMIT ?", args + [HISTORY_EXPORT_MAX_ROWS]):
+            writer.writerow([row[column] for column in columns])
+    return buffer.getvalue().encode("utf-8")
+
+# ---------------- SIDEBAR: AUTO-FIND BACKEND (FRAGMENT) ----------------
+@st.fragment
+@timed("Sidebar status")
+def render_backend_status():
+    """Backend finder and status - reruns on its own when its buttons are used"""
     st.markdown("### 📡 Backend Status")
     st.markdown("---")
     
@@ -315,7 +526,6 @@ with st.sidebar:
         # Show backend info
         backend_info = st.session_state.backend_info
         if backend_info.get('last_updated'):
-            from datetime import datetime
             last_update = datetime.fromisoformat(backend_info['last_updated'].replace('Z', '+00:00'))
             now = datetime.now()
             hours_ago = int((now - last_update).total_seconds() / 3600)
@@ -349,6 +559,62 @@ with st.sidebar:
                 st.session_state.backend_url = manual_url.rstrip('/')
                 st.session_state.backend_status = "manual"
                 st.rerun()
+
+@st.fragment
+@timed("History panel")
+def render_history_panel():
+    """Past captions with full-text search - paging only reruns this panel"""
+    with st.expander("🗂️ Caption History"):
+        search = st.text_input("Search captions:", placeholder="e.g. dog on a beach")
+        
+        # A new search starts again from the newest page
+        if search != st.session_state.history_search:
+            st.session_state.history_search = search
+            st.session_state.history_cursors = [None]
+        cursors = st.session_state.history_cursors
+        
+        try:
+            rows = query_history(search, cursors[-1])
+        except sqlite3.Error as e:
+            st.error(f"History search failed: {e}")
+            return
+        
+        if not rows:
+            st.info("No saved captions found.")
+        
+        for row in rows:
+            details = f"**{row['caption_type']}** • {row['created_at']}"
+            if row['model']:
+                details += f" • {row['model']}"
+            st.markdown(details)
+            st.caption(row['caption'])
+        
+        # Keyset pagination - each page remembers the last id it showed
+        last_id = rows[-1]['id'] if rows else None
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button("◀ Newer", disabled=len(cursors) == 1, on_click=cursors.pop,
+                      use_container_width=True)
+        with col2:
+            st.button("Older ▶", disabled=len(rows) < HISTORY_PAGE_SIZE, on_click=cursors.append,
+                      args=(last_id,), use_container_width=True)
+        st.caption(f"Page {len(cursors)}")
+        
+        # Bulk export (matches the current search) - the CSV is only built on click
+        st.download_button(
+            "⬇️ Download CSV",
+            functools.partial(export_history_csv, search),
+            file_name="caption_history.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
+        st.caption(f"Exports the newest {HISTORY_EXPORT_MAX_ROWS:,} matching captions at most.")
+
+with st.sidebar:
+    render_backend_status()
+    
+    st.markdown("---")
+    render_history_panel()
     
     st.markdown("---")
     st.markdown("**How it works:**")
@@ -356,12 +622,15 @@ with st.sidebar:
     st.markdown("2. Click 'Find Colab Backend'")
     st.markdown("3. Upload image & generate captions")
     st.markdown("4. Colab runs for ~12 hours automatically")
-
-# ---------------- LAYOUT (EXACT ORIGINAL - UNCHANGED) ----------------
-left, right = st.columns(2, gap="large")
-
-# ---------------- LEFT: IMAGE (EXACT ORIGINAL - UNCHANGED) ----------------
-with left:
+    
+    # Filled in at the end of the script, once the full run has been measured
+    timings_placeholder = st.empty()
+
+# ---------------- LEFT: IMAGE (FRAGMENT) ----------------
+@st.fragment
+@timed("Image panel")
+def render_image_panel():
+    """Upload box and preview - only this panel reruns while picking a file"""
     st.markdown('<div class="panel">', unsafe_allow_html=True)
     st.markdown("<h3>Upload Image</h3>", unsafe_allow_html=True)
     
@@ -383,20 +652,18 @@ with left:
     if uploaded_file is not None:
         if 'last_uploaded_file' not in st.session_state or st.session_state.last_uploaded_file != uploaded_file.name:
             try:
-                # Open and process the image
-                image = Image.open(uploaded_file)
+                # Open and process the image (size-checked and bounded)
+                image = load_upload_image(uploaded_file)
                 
-                # IMPORTANT: Store ORIGINAL image for API (not resized)
+                # IMPORTANT: Store full-quality image for API (only capped at MAX_IMAGE_SIDE)
                 st.session_state.uploaded_image = image
                 
-                # Get image dimensions
-                original_width, original_height = image.size
+                # Hash the uploaded bytes so past captions for this image can be reused
+                st.session_state.image_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+                st.session_state.regenerate_requested = False
                 
                 # Resize ONLY for display
-                container_width = 600
-                container_height = 450
-                
-                resized_image = image.resize((container_width, container_height), Image.Resampling.LANCZOS)
+                resized_image = image.resize(PREVIEW_SIZE, Image.Resampling.LANCZOS, reducing_gap=2.0)
                 
                 # Convert to base64 for HTML embedding
                 buffered = BytesIO()
@@ -416,6 +683,7 @@ with left:
                 st.session_state.captions_generated = False
                 st.session_state.generated_captions = {}
                 
+                # Full rerun so the output section is reset as well
                 st.rerun()
                 
             except Exception as e:
@@ -425,8 +693,11 @@ with left:
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-# ---------------- RIGHT: OPTIONS (EXACT ORIGINAL - UNCHANGED) ----------------
-with right:
+# ---------------- RIGHT: OPTIONS (FRAGMENT) ----------------
+@st.fragment
+@timed("Options panel")
+def render_options_panel():
+    """Style, word limits and Generate - sliders/radio only rerun this panel"""
     st.markdown('<div class="panel">', unsafe_allow_html=True)
     st.markdown("<h3>Caption Style</h3>", unsafe_allow_html=True)
     
@@ -444,14 +715,19 @@ with right:
     st.markdown('</div>', unsafe_allow_html=True)
     
     st.markdown('</div>', unsafe_allow_html=True)
-
-# Handle generate button click
-if generate_clicked:
-    if st.session_state.backend_status != "connected":
-        st.error("❌ Please connect to backend first (click 'Find Colab Backend' in sidebar)")
-    elif not st.session_state.get("uploaded_image"):
-        st.warning("⚠️ Please upload an image first!")
-    else:
+    
+    # Report a failed history save from the last generation
+    if st.session_state.get("history_save_error"):
+        st.warning(f"⚠️ Captions were not saved to history: {st.session_state.history_save_error}")
+        st.session_state.history_save_error = None
+    
+    # Tell the user when captions came from history rather than the backend
+    if st.session_state.get("history_reused"):
+        st.toast("♻️ Reused saved captions from history")
+        st.session_state.history_reused = False
+    
+    # Handle generate button click
+    if generate_clicked:
         # Prepare parameters with DYNAMIC word limits
         if style == "All":
             styles = ["all"]
@@ -470,96 +746,156 @@ if generate_clicked:
             "human-friendly": human_words
         }
         
-        # Show loading
-        with st.spinner("🔄 Generating captions with your settings... Please wait 30-60 seconds..."):
-            # Call API with ORIGINAL image and DYNAMIC word limits
-            result = generate_captions_from_api(
-                st.session_state.uploaded_image,
-                styles,
-                word_limits
-            )
-            
-            if result.get('success'):
-                st.session_state.captions_generated = True
-                st.session_state.current_style = style
-                st.session_state.generated_captions = result.get('captions', {})
-                st.rerun()
-            else:
-                error_msg = result.get('error', 'Unknown error')
-                st.error(f"❌ Error: {error_msg}")
+        # Reuse captions already generated for this image, settings and model
+        # (skipped when the user asked for new captions)
+        caption_types = list(word_limits) if style == "All" else styles
+        cached_captions = {}
+        if (st.session_state.get("uploaded_image") and st.session_state.image_hash
+                and not st.session_state.get("regenerate_requested")):
+            try:
+                cached_captions = find_captions_in_history(
+                    st.session_state.image_hash,
+                    caption_types,
+                    word_limits,
+                    st.session_state.backend_info.get('model')
+                )
+            except sqlite3.Error:
+                # History unavailable - just call the backend
+                cached_captions = {}
+        
+        if cached_captions:
+            # Shown after the rerun below
+            st.session_state.history_reused = True
+            st.session_state.captions_generated = True
+            st.session_state.current_style = style
+            st.session_state.generated_captions = cached_captions
+            # Full rerun so the output section picks up the saved captions
+            st.rerun()
+        elif st.session_state.backend_status != "connected":
+            st.error("❌ Please connect to backend first (click 'Find Colab Backend' in sidebar)")
+        elif not st.session_state.get("uploaded_image"):
+            st.warning("⚠️ Please upload an image first!")
+        else:
+            # Show loading
+            with st.spinner("🔄 Generating captions with your settings... Please wait 30-60 seconds..."):
+                # Call API with uploaded image and DYNAMIC word limits
+                started = time.perf_counter()
+                result = generate_captions_from_api(
+                    st.session_state.uploaded_image,
+                    styles,
+                    word_limits
+                )
+                duration_ms = round((time.perf_counter() - started) * 1000, 1)
                 
-                # Helpful suggestions
-                if "Timeout" in error_msg:
-                    st.info("💡 The Colab backend might be starting up. Try again in 60 seconds.")
-                elif "Connection" in error_msg or "refused" in error_msg:
-                    st.info("💡 The Colab backend may have disconnected. Click 'Find Colab Backend' again.")
-
-# ---------------- OUTPUT SECTION (EXACT ORIGINAL - UNCHANGED) ----------------
-st.markdown("<br><br>", unsafe_allow_html=True)
-st.markdown('<div class="output-section">', unsafe_allow_html=True)
-
-# Display captions if they should be shown
-if st.session_state.get("captions_generated", False) and st.session_state.generated_captions:
-    # Caption data
-    caption_display = {
-        "short": {
-            "icon": "⚡",
-            "title": "Short Caption",
-            "class": "card-short"
-        },
-        "technical": {
-            "icon": "🔬",
-            "title": "Technical Caption",
-            "class": "card-technical"
-        },
-        "human-friendly": {
-            "icon": "😊",
-            "title": "Human-friendly Caption",
-            "class": "card-friendly"
-        }
-    }
-    
-    # Display title
-    st.markdown('<div class="output-title">✨ Generated Captions</div>', unsafe_allow_html=True)
-    
-    # FIXED ORDER: Display in correct order - Short, Technical, Human-friendly
-    caption_order = ["short", "technical", "human-friendly"]
+                if result.get('success'):
+                    captions = result.get('captions', {})
+                    
+                    # Keep every generated caption so it survives page reloads
+                    try:
+                        save_captions_to_history(
+                            st.session_state.image_hash,
+                            captions,
+                            styles,
+                            word_limits,
+                            st.session_state.backend_info.get('model'),
+                            duration_ms
+                        )
+                    except sqlite3.Error as e:
+                        # Shown after the rerun below
+                        st.session_state.history_save_error = str(e)
+                    
+                    st.session_state.regenerate_requested = False
+                    st.session_state.captions_generated = True
+                    st.session_state.current_style = style
+                    st.session_state.generated_captions = captions
+                    # Full rerun so the output section picks up the new captions
+                    st.rerun()
+                else:
+                    error_msg = result.get('error', 'Unknown error')
+                    st.error(f"❌ Error: {error_msg}")
+                    
+                    # Helpful suggestions
+                    if "Timeout" in error_msg:
+                        st.info("💡 The Colab backend might be starting up. Try again in 60 seconds.")
+                    elif "Connection" in error_msg or "refused" in error_msg:
+                        st.info("💡 The Colab backend may have disconnected. Click 'Find Colab Backend' again.")
+
+# ---------------- OUTPUT SECTION (FRAGMENT) ----------------
+@st.fragment
+@timed("Output section")
+def render_output_section():
+    """Caption cards - clearing them only reruns this section"""
+    st.markdown("<br><br>", unsafe_allow_html=True)
+    st.markdown('<div class="output-section">', unsafe_allow_html=True)
     
-    for caption_type in caption_order:
-        if caption_type in st.session_state.generated_captions:
-            caption_data = st.session_state.generated_captions[caption_type]
-            card_info = caption_display[caption_type]
-            caption_text = caption_data.get('caption', '')
-            
-            st.markdown(f"""
-            <div class="output-card {card_info['class']}">
-                <div class="card-header">
-                    <span class="card-icon">{card_info['icon']}</span>
-                    <h3 class="card-title">{card_info['title']}</h3>
-                </div>
-                <div class="card-content">
-                    {caption_text}
+    # Display captions if they should be shown
+    if st.session_state.get("captions_generated", False) and st.session_state.generated_captions:
+        # Caption data
+        caption_display = {
+            "short": {
+                "icon": "⚡",
+                "title": "Short Caption",
+                "class": "card-short"
+            },
+            "technical": {
+                "icon": "🔬",
+                "title": "Technical Caption",
+                "class": "card-technical"
+            },
+            "human-friendly": {
+                "icon": "😊",
+                "title": "Human-friendly Caption",
+                "class": "card-friendly"
+            }
+        }
+        
+        # Display title
+        st.markdown('<div class="output-title">✨ Generated Captions</div>', unsafe_allow_html=True)
+        
+        # FIXED ORDER: Display in correct order - Short, Technical, Human-friendly
+        caption_order = ["short", "technical", "human-friendly"]
+        
+        for caption_type in caption_order:
+            if caption_type in st.session_state.generated_captions:
+                caption_data = st.session_state.generated_captions[caption_type]
+                card_info = caption_display[caption_type]
+                caption_text = caption_data.get('caption', '')
+                
+                st.markdown(f"""
+                <div class="output-card {card_info['class']}">
+                    <div class="card-header">
+                        <span class="card-icon">{card_info['icon']}</span>
+                        <h3 class="card-title">{card_info['title']}</h3>
+                    </div>
+                    <div class="card-content">
+                        {caption_text}
+                    </div>
                 </div>
-            </div>
-            """, unsafe_allow_html=True)
+                """, unsafe_allow_html=True)
+        
+        # Add a refresh/regenerate option (the button's fragment rerun redraws this section)
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col2:
+            st.markdown("<br>", unsafe_allow_html=True)
+            st.button("🔄 Generate New Captions", type="secondary", on_click=clear_captions,
+                      use_container_width=True)
     
-    # Add a refresh/regenerate option
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
-        st.markdown("<br>", unsafe_allow_html=True)
-        if st.button("🔄 Generate New Captions", type="secondary", use_container_width=True):
-            st.session_state.captions_generated = False
-            st.session_state.generated_captions = {}
-            st.rerun()
+    else:
+        # Nothing generated yet
+        st.markdown('<div class="empty-output">📷 Upload an image and click "Generate Captions" to see results here.</div>', unsafe_allow_html=True)
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+
+# ---------------- LAYOUT ----------------
+left, right = st.columns(2, gap="large")
+
+with left:
+    render_image_panel()
 
-elif st.session_state.get("uploaded_image"):
-    # Image uploaded but no captions generated yet
-    st.markdown('<div class="empty-output">📷 Upload an image and click "Generate Captions" to see results here.</div>', unsafe_allow_html=True)
-else:
-    # No image uploaded at all
-    st.markdown('<div class="empty-output">📷 Upload an image and click "Generate Captions" to see results here.</div>', unsafe_allow_html=True)
+with right:
+    render_options_panel()
 
-st.markdown('</div>', unsafe_allow_html=True)
+render_output_section()
 
 # ---------------- FOOTER (EXACT ORIGINAL - UNCHANGED) ----------------
 st.markdown("""
@@ -579,4 +915,11 @@ if st.session_state.backend_status == "checking":
         else:
             st.session_state.backend_status = "disconnected"
 
+# ---------------- RERUN TIMINGS ----------------
+st.session_state.rerun_timings["Full page"] = round((time.perf_counter() - SCRIPT_STARTED) * 1000, 1)
 
+with timings_placeholder.container():
+    with st.expander("⏱️ Rerun Timings"):
+        for name, elapsed_ms in st.session_state.rerun_timings.items():
+            st.markdown(f"**{name}:** {elapsed_ms} ms")
+        st.caption("Panels rerun on their own; this list refreshes on full page reruns.")